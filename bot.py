@@ -10,6 +10,7 @@ from pyrogram.enums import ParseMode as PyrogramParseMode
 
 from config import BOT_TOKEN, API_ID, API_HASH, TEMP_DIR
 from handlers import register_handlers
+from zip_utils import shutdown_pool
 
 # Configure logging
 logging.basicConfig(
@@ -45,20 +46,20 @@ async def main():
     # Register all handlers
     register_handlers(dp, bot, app)
     
-    # Start Pyrogram client
-    await app.start()
-    logger.info("Pyrogram client started")
-    
-    # Start polling
-    logger.info("Bot is running...")
-    await dp.start_polling(bot)
-    
-    # Wait until bot is stopped
-    await asyncio.Event().wait()
-    
-    # Cleanup on exit
-    await app.stop()
-    await bot.session.close()
+    try:
+        # Start Pyrogram client
+        await app.start()
+        logger.info("Pyrogram client started")
+        
+        # Start polling (blocks until the bot is stopped)
+        logger.info("Bot is running...")
+        await dp.start_polling(bot)
+    finally:
+        # Cleanup on exit
+        if app.is_connected:
+            await app.stop()
+        await bot.session.close()
+        shutdown_pool()
     logger.info("Bot stopped")
 
 if __name__ == "__main__":
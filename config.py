@@ -24,6 +24,15 @@ os.makedirs(TEMP_DIR, exist_ok=True)
 # Maximum chunk size for file processing (in bytes) - 10MB
 CHUNK_SIZE = 10 * 1024 * 1024
 
+# Buffer size for sequential file reads during compression (in bytes) - 1MB
+READ_BUFFER_SIZE = 1 * 1024 * 1024
+
+# Files larger than this are ZIP-compressed at the fastest level (in bytes) - 100MB
+FAST_COMPRESSION_SIZE = 100 * 1024 * 1024
+
+# Size of each part when splitting files over Telegram's 50MB bot upload limit (in bytes) - 45MB
+SPLIT_PART_SIZE = 45 * 1024 * 1024
+
 # Supported compression formats
 COMPRESSION_FORMATS = {
     "zip": ".zip",
@@ -0,0 +1,21 @@
+# fs_utils.py - Shared filesystem helpers
+import os
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def silent_remove(path: str):
+    """
+    Remove a file, ignoring it if it is already gone
+    
+    Args:
+        path: Path to the file to remove
+    """
+    try:
+        os.remove(path)
+    except (FileNotFoundError, IsADirectoryError):
+        pass
+    except OSError as e:
+        logger.error(f"Error removing temp file {path}: {e}")
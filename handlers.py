@@ -3,20 +3,22 @@ import os
 import asyncio
 import logging
 import time
+import itertools
 from typing import Dict, Any, Optional, Union, List, Tuple
 import mimetypes
 from datetime import datetime
 import aiofiles
 from aiogram import Router, F, Dispatcher, Bot
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.filters import Command, CommandObject
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from pyrogram import Client
 from pyrogram.types import Message as PyrogramMessage
 
-from config import TEMP_DIR, COMPRESSION_FORMATS, MAX_PREVIEW_SIZE, FILE_STORAGE_TIME, MAX_CONCURRENT_TASKS
+from config import TEMP_DIR, COMPRESSION_FORMATS, MAX_PREVIEW_SIZE, FILE_STORAGE_TIME, MAX_CONCURRENT_TASKS, SPLIT_PART_SIZE, READ_BUFFER_SIZE
 from strings import get_message
-from zip_utils import compress_file, extract_archive, is_archive_file, get_file_info, clean_temp_files
+from fs_utils import silent_remove
+from zip_utils import compress_file, extract_archive, is_archive_file, get_file_info, clean_temp_files, split_file
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,7 +27,19 @@ logger = logging.getLogger(__name__)
 # Store user active tasks and languages
 user_tasks: Dict[int, Dict[str, Any]] = {}
 user_languages: Dict[int, str] = {}
-concurrent_tasks = 0
+
+# Per-user temp directory paths; kept apart from user_tasks, which is reset after every task
+user_temp_dirs: Dict[int, str] = {}
+
+# Limit the number of downloads/compressions/extractions running at once
+task_semaphore = asyncio.BoundedSemaphore(MAX_CONCURRENT_TASKS)
+
+# Short integer tokens used in callback_data instead of file paths
+_token_counter = itertools.count(1)
+_tokens: Dict[int, Dict[str, Any]] = {}
+
+# Compression format button labels, built once
+_FORMAT_BUTTONS = [(format_name, f"📦 {format_name.upper()}") for format_name in COMPRESSION_FORMATS]
 
 # Setup routers
 main_router = Router()
@@ -42,6 +56,26 @@ async def clean_old_files():
             logger.error(f"Error cleaning old files: {e}")
             await asyncio.sleep(3600)
 
+def create_file_token(file_path: str, user_id: int) -> int:
+    """Register a downloaded file and return a short token for callback_data"""
+    token = next(_token_counter)
+    _tokens[token] = {"path": file_path, "user": user_id}
+    
+    # Forget the token once the file itself would have been cleaned up
+    asyncio.get_running_loop().call_later(FILE_STORAGE_TIME * 3600, _tokens.pop, token, None)
+    return token
+
+def resolve_file_token(token: str, user_id: int) -> Optional[str]:
+    """Return the file path for a callback token, or None if unknown or owned by another user"""
+    try:
+        meta = _tokens.get(int(token))
+    except ValueError:
+        return None
+    
+    if meta is None or meta["user"] != user_id:
+        return None
+    return meta["path"]
+
 # Register command handlers
 @main_router.message(Command("start"))
 async def cmd_start(message: Message):
@@ -75,11 +109,7 @@ async def cmd_cancel(message: Message):
         # Clean up resources
         if "temp_files" in user_tasks[user_id]:
             for temp_file in user_tasks[user_id]["temp_files"]:
-                if os.path.exists(temp_file):
-                    try:
-                        os.remove(temp_file)
-                    except Exception as e:
-                        logger.error(f"Error removing temp file: {e}")
+                silent_remove(temp_file)
         
         # Clear user task
         user_tasks[user_id] = {}
@@ -92,8 +122,6 @@ async def cmd_cancel(message: Message):
 @main_router.message(F.document)
 async def handle_document(message: Message, bot: Bot):
     """Handle document messages (files)"""
-    global concurrent_tasks
-    
     user_id = message.from_user.id
     lang = get_user_language(message)
     
@@ -103,218 +131,229 @@ async def handle_document(message: Message, bot: Bot):
         return
     
     # Check concurrent task limit
-    if concurrent_tasks >= MAX_CONCURRENT_TASKS:
+    if task_semaphore.locked():
         await message.answer(get_message("error_general", lang, error="Too many active tasks. Please try again later."))
         return
     
-    # Initialize user task
-    user_tasks[user_id] = {"temp_files": []}
-    
-    try:
-        # Get file info
-        file_id = message.document.file_id
-        file_name = message.document.file_name or "unknown_file"
-        file_size = message.document.file_size or 0
-        file_size_mb = file_size / (1024 * 1024)
-        
-        # Create temp directory for user if it doesn't exist
-        user_temp_dir = os.path.join(TEMP_DIR, str(user_id))
-        os.makedirs(user_temp_dir, exist_ok=True)
+    async with task_semaphore:
+        # Initialize user task
+        user_temp_dir = user_temp_dirs.get(user_id)
+        if user_temp_dir is None:
+            user_temp_dir = user_temp_dirs[user_id] = os.path.join(TEMP_DIR, str(user_id))
+        user_tasks[user_id] = {"temp_files": []}
         
-        # Get file path to download
-        file_path = os.path.join(user_temp_dir, file_name)
-        user_tasks[user_id]["temp_files"].append(file_path)
-        
-        # Inform user
-        await message.answer(get_message("file_received", lang, file_name=file_name, file_size_mb=file_size_mb))
-        
-        # Download file
-        await message.answer(get_message("processing", lang))
-        await bot.download(file=file_id, destination=file_path)
+        try:
+            # Get file info
+            file_id = message.document.file_id
+            file_name = message.document.file_name or "unknown_file"
+            file_size = message.document.file_size or 0
+            file_size_mb = file_size / (1024 * 1024)
+            
+            # Create temp directory for user if it doesn't exist
+            os.makedirs(user_temp_dir, exist_ok=True)
+            
+            # Get file path to download
+            file_path = os.path.join(user_temp_dir, file_name)
+            user_tasks[user_id]["temp_files"].append(file_path)
+            
+            # Inform user
+            await message.answer(get_message("file_received", lang, file_name=file_name, file_size_mb=file_size_mb))
+            
+            # Download file
+            await message.answer(get_message("processing", lang))
+            await bot.download(file=file_id, destination=file_path)
+            
+            # Check if file is an archive
+            token = create_file_token(file_path, user_id)
+            if await asyncio.to_thread(is_archive_file, file_path):
+                # Show extract button
+                builder = InlineKeyboardBuilder()
+                builder.button(text="📂 Extract", callback_data=f"extract:{token}")
+                builder.button(text="🔎 Preview", callback_data=f"preview:{token}")
+                await message.answer("Choose action:", reply_markup=builder.as_markup())
+            else:
+                # Show compression format options
+                builder = InlineKeyboardBuilder()
+                for format_name, button_text in _FORMAT_BUTTONS:
+                    builder.button(text=button_text, callback_data=f"compress:{token}:{format_name}")
+                builder.adjust(2)
+                await message.answer(get_message("compress_format_select", lang), reply_markup=builder.as_markup())
         
-        # Check if file is an archive
-        if is_archive_file(file_path):
-            # Show extract button
-            builder = InlineKeyboardBuilder()
-            builder.button(text="📂 Extract", callback_data=f"extract:{file_path}")
-            builder.button(text="🔎 Preview", callback_data=f"preview:{file_path}")
-            await message.answer("Choose action:", reply_markup=builder.as_markup())
-        else:
-            # Show compression format options
-            builder = InlineKeyboardBuilder()
-            for format_name in COMPRESSION_FORMATS:
-                builder.button(text=f"📦 {format_name.upper()}", callback_data=f"compress:{file_path}:{format_name}")
-            builder.adjust(2)
-            await message.answer(get_message("compress_format_select", lang), reply_markup=builder.as_markup())
+        except Exception as e:
+            logger.error(f"Error handling document: {e}", exc_info=True)
+            await message.answer(get_message("error_processing", lang, error=str(e)))
+            
+            # Clean up
+            if user_id in user_tasks:
+                for temp_file in user_tasks[user_id].get("temp_files", []):
+                    silent_remove(temp_file)
+                user_tasks[user_id] = {}
+
+async def split_and_send_file(file_path: str, chat_id: int, bot: Bot, lang: str):
+    """
+    Split a file that exceeds Telegram's upload limit and send the parts
     
-    except Exception as e:
-        logger.error(f"Error handling document: {e}", exc_info=True)
-        await message.answer(get_message("error_processing", lang, error=str(e)))
-        
-        # Clean up
-        if user_id in user_tasks:
-            for temp_file in user_tasks[user_id].get("temp_files", []):
-                if os.path.exists(temp_file):
-                    try:
-                        os.remove(temp_file)
-                    except Exception as e:
-                        logger.error(f"Error removing temp file: {e}")
-            user_tasks[user_id] = {}
+    Args:
+        file_path: Path to the file to split
+        chat_id: Chat to send the parts to
+        bot: Bot instance used for sending
+        lang: Language code for captions
+    """
+    parts = await asyncio.to_thread(split_file, file_path, os.path.dirname(file_path), SPLIT_PART_SIZE)
+    try:
+        for index, part_path in enumerate(parts, start=1):
+            await bot.send_document(
+                chat_id,
+                document=FSInputFile(part_path, chunk_size=READ_BUFFER_SIZE),
+                caption=get_message("split_part", lang, part=index, total=len(parts))
+            )
+    finally:
+        for part_path in parts:
+            silent_remove(part_path)
 
 # Handle callback queries
 @callback_router.callback_query(F.data.startswith("compress:"))
 async def compress_callback(callback: CallbackQuery, bot: Bot):
     """Handle compression callback queries"""
-    global concurrent_tasks
-    
     await callback.answer()
     user_id = callback.from_user.id
     lang = user_languages.get(user_id, "en")
     
     # Parse callback data
-    _, file_path, format_name = callback.data.split(":", 2)
+    _, _, rest = callback.data.partition(":")
+    token, _, format_name = rest.partition(":")
+    file_path = resolve_file_token(token, user_id)
     
-    if not os.path.exists(file_path):
+    if file_path is None or not os.path.exists(file_path):
         await callback.message.answer(get_message("error_processing", lang, error="File not found"))
         return
     
-    # Update user task
-    user_tasks[user_id]["operation"] = "compress"
-    user_tasks[user_id]["file_path"] = file_path
-    user_tasks[user_id]["format"] = format_name
-    
-    try:
-        # Increment concurrent tasks
-        concurrent_tasks += 1
-        
-        # Update progress message
-        progress_message = await callback.message.answer(
-            get_message("compressing", lang, format=format_name.upper(), progress=0)
-        )
-        
-        # Define progress callback
-        async def update_progress(progress: int):
-            try:
-                await bot.edit_message_text(
-                    get_message("compressing", lang, format=format_name.upper(), progress=progress),
-                    chat_id=callback.message.chat.id,
-                    message_id=progress_message.message_id
-                )
-            except Exception as e:
-                logger.error(f"Error updating progress: {e}")
-        
-        # Start compression task
-        task = asyncio.create_task(compress_file(file_path, format_name, update_progress))
-        user_tasks[user_id]["task"] = task
-        
-        # Wait for compression to complete
-        output_path = await task
-        user_tasks[user_id]["temp_files"].append(output_path)
-        
-        # Send compressed file
-        await callback.message.answer(get_message("compression_complete", lang))
+    async with task_semaphore:
+        # Update user task
+        user_tasks[user_id]["operation"] = "compress"
+        user_tasks[user_id]["file_path"] = file_path
+        user_tasks[user_id]["format"] = format_name
         
-        # Check file size
-        if os.path.getsize(output_path) > 50 * 1024 * 1024:  # 50MB (Telegram limit)
-            await callback.message.answer(get_message("file_too_large_telegram", lang))
-            
-            # Split file into parts and send
-            await split_and_send_file(output_path, callback.message.chat.id, bot, lang)
-        else:
-            # Send compressed file
-            await bot.send_document(
-                callback.message.chat.id,
-                document=output_path,
-                caption=f"Compressed file ({format_name.upper()})"
+        try:
+            # Update progress message
+            progress_message = await callback.message.answer(
+                get_message("compressing", lang, format=format_name.upper(), progress=0)
             )
-        
-        # Clean up
-        for temp_file in user_tasks[user_id].get("temp_files", []):
-            if os.path.exists(temp_file):
+            
+            # Define progress callback
+            async def update_progress(progress: int):
                 try:
-                    os.remove(temp_file)
+                    await bot.edit_message_text(
+                        get_message("compressing", lang, format=format_name.upper(), progress=progress),
+                        chat_id=callback.message.chat.id,
+                        message_id=progress_message.message_id
+                    )
                 except Exception as e:
-                    logger.error(f"Error removing temp file: {e}")
-        
-        user_tasks[user_id] = {}
-        
-    except asyncio.CancelledError:
-        await callback.message.answer(get_message("task_cancelled", lang))
-    except Exception as e:
-        logger.error(f"Error compressing file: {e}", exc_info=True)
-        await callback.message.answer(get_message("error_compression", lang, error=str(e)))
-    finally:
-        # Decrement concurrent tasks
-        concurrent_tasks -= 1
+                    logger.error(f"Error updating progress: {e}")
+            
+            # Start compression task
+            task = asyncio.create_task(compress_file(file_path, format_name, update_progress))
+            user_tasks[user_id]["task"] = task
+            
+            # Wait for compression to complete
+            output_path = await task
+            user_tasks[user_id]["temp_files"].append(output_path)
+            
+            # Send compressed file
+            await callback.message.answer(get_message("compression_complete", lang))
+            
+            # Check file size
+            output_size = os.stat(output_path).st_size
+            if output_size > 50 * 1024 * 1024:  # 50MB (Telegram limit)
+                await callback.message.answer(get_message("file_too_large_telegram", lang))
+                
+                # Split file into parts and send
+                await split_and_send_file(output_path, callback.message.chat.id, bot, lang)
+            else:
+                # Send compressed file
+                await bot.send_document(
+                    callback.message.chat.id,
+                    document=FSInputFile(output_path, chunk_size=READ_BUFFER_SIZE),
+                    caption=f"Compressed file ({format_name.upper()})"
+                )
+            
+            # Clean up
+            for temp_file in user_tasks[user_id].get("temp_files", []):
+                silent_remove(temp_file)
+            
+            user_tasks[user_id] = {}
+            
+        except asyncio.CancelledError:
+            await callback.message.answer(get_message("task_cancelled", lang))
+        except Exception as e:
+            logger.error(f"Error compressing file: {e}", exc_info=True)
+            await callback.message.answer(get_message("error_compression", lang, error=str(e)))
 
 @callback_router.callback_query(F.data.startswith("extract:"))
 async def extract_callback(callback: CallbackQuery, bot: Bot):
     """Handle extraction callback queries"""
-    global concurrent_tasks
-    
     await callback.answer()
     user_id = callback.from_user.id
     lang = user_languages.get(user_id, "en")
     
     # Parse callback data
-    _, file_path = callback.data.split(":", 1)
+    _, _, token = callback.data.partition(":")
+    file_path = resolve_file_token(token, user_id)
     
-    if not os.path.exists(file_path):
+    if file_path is None or not os.path.exists(file_path):
         await callback.message.answer(get_message("error_processing", lang, error="File not found"))
         return
     
-    # Update user task
-    user_tasks[user_id]["operation"] = "extract"
-    user_tasks[user_id]["file_path"] = file_path
-    
-    try:
-        # Increment concurrent tasks
-        concurrent_tasks += 1
-        
-        # Create extraction directory
-        extract_dir = os.path.join(TEMP_DIR, f"{user_id}_extracted_{int(time.time())}")
-        os.makedirs(extract_dir, exist_ok=True)
-        user_tasks[user_id]["extract_dir"] = extract_dir
-        
-        # Update progress message
-        progress_message = await callback.message.answer(
-            get_message("extracting", lang, progress=0)
-        )
-        
-        # Define progress callback
-        async def update_progress(progress: int):
-            try:
-                await bot.edit_message_text(
-                    get_message("extracting", lang, progress=progress),
-                    chat_id=callback.message.chat.id,
-                    message_id=progress_message.message_id
-                )
-            except Exception as e:
-                logger.error(f"Error updating progress: {e}")
-        
-        # Start extraction task
-        task = asyncio.create_task(extract_archive(file_path, extract_dir, update_progress))
-        user_tasks[user_id]["task"] = task
-        
-        # Wait for extraction to complete
-        extracted_files = await task
-        
-        # Send extracted files
-        await callback.message.answer(get_message("extraction_complete", lang))
+    async with task_semaphore:
+        # Update user task
+        user_tasks[user_id]["operation"] = "extract"
+        user_tasks[user_id]["file_path"] = file_path
         
-        # If there are too many files, compress them and send as a single archive
-        if len(extracted_files) > 10:
-            await callback.message.answer(
-                get_message("extraction_too_many_files", lang, count=len(extracted_files))
-            )
+        try:
+            # Create extraction directory
+            extract_dir = os.path.join(TEMP_DIR, f"{user_id}_extracted_{int(time.time())}")
+            os.makedirs(extract_dir, exist_ok=True)
+            user_tasks[user_id]["extract_dir"] = extract_dir
             
-            # Create a zip of extracted files
-            zip_path = os.path.join(TEMP_DIR, f"extracted_files_{user_id}.zip")
-            user_tasks[user_id]["temp_files"].append(zip_path)
+            # Update progress message
+            progress_message = await callback.message.answer(
+                get_message("extracting", lang, progress=0)
+            )
             
-            # Define progress callback for compression
-            async def update_zip_progress(progress: int):
+            # Define progress callback
+            async def update_progress(progress: int):
                 try:
                     await bot.edit_message_text(
-                        get_message("compressing", lang, format="ZIP", progress=progress),
-                        chat_id=callback
\ No newline at end of file
+                        get_message("extracting", lang, progress=progress),
+                        chat_id=callback.message.chat.id,
+                        message_id=progress_message.message_id
+                    )
+                except Exception as e:
+                    logger.error(f"Error updating progress: {e}")
+            
+            # Start extraction task
+            task = asyncio.create_task(extract_archive(file_path, extract_dir, update_progress))
+            user_tasks[user_id]["task"] = task
+            
+            # Wait for extraction to complete
+            extracted_files = await task
+            
+            # Send extracted files
+            await callback.message.answer(get_message("extraction_complete", lang))
+            
+            # If there are too many files, compress them and send as a single archive
+            if len(extracted_files) > 10:
+                await callback.message.answer(
+                    get_message("extraction_too_many_files", lang, count=len(extracted_files))
+                )
+                
+                # Create a zip of extracted files
+                zip_path = os.path.join(TEMP_DIR, f"extracted_files_{user_id}.zip")
+                user_tasks[user_id]["temp_files"].append(zip_path)
+                
+                # Define progress callback for compression
+                async def update_zip_progress(progress: int):
+                    try:
+                        await bot.edit_message_text(
+                            get_message("compressing", lang, format="ZIP", progress=progress),
+                            chat_id=callback
\ No newline at end of file
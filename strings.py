@@ -1,5 +1,6 @@
 # strings.py - Message strings for the Telegram File Compression Bot
 # Supports both English and Persian languages
+from string import Formatter
 
 MESSAGES = {
     "en": {
@@ -17,25 +18,25 @@ MESSAGES = {
                 "• No file size limits\n"
                 "• Fast processing with streaming\n"
                 "• Progress tracking\n",
-        "file_received": "File received: {}\nSize: {:.2f} MB\n\nWhat would you like to do with this file?",
+        "file_received": "File received: {file_name}\nSize: {file_size_mb:.2f} MB\n\nWhat would you like to do with this file?",
         "processing": "Processing your file... Please wait.",
-        "compressing": "Compressing your file to {}...\n\nProgress: {}%",
-        "extracting": "Extracting your file...\n\nProgress: {}%",
+        "compressing": "Compressing your file to {format}...\n\nProgress: {progress}%",
+        "extracting": "Extracting your file...\n\nProgress: {progress}%",
         "compression_complete": "Compression complete! Sending the compressed file...",
         "extraction_complete": "Extraction complete! Sending the extracted file(s)...",
-        "extraction_too_many_files": "Extraction complete! There are {} files. Sending them as a compressed archive...",
+        "extraction_too_many_files": "Extraction complete! There are {count} files. Sending them as a compressed archive...",
         "task_cancelled": "Task cancelled successfully.",
         "no_active_task": "No active task to cancel.",
         "error_unsupported_format": "Unsupported file format. Supported formats for extraction: zip, tar.gz, rar, 7z",
-        "error_processing": "Error processing your file: {}",
+        "error_processing": "Error processing your file: {error}",
         "error_file_corrupted": "The file appears to be corrupted or invalid.",
         "error_extraction": "Could not extract the file. The file might be password-protected or corrupted.",
-        "error_compression": "Could not compress the file: {}",
+        "error_compression": "Could not compress the file: {error}",
         "compress_format_select": "Select compression format:",
         "file_too_large_telegram": "The file is too large to be sent via Telegram. I'll split it into smaller parts.",
-        "split_part": "Part {}/{} of your extraction",
-        "preview_content": "Preview of file content:\n\n```\n{}\n```",
-        "error_general": "An error occurred: {}. Please try again.",
+        "split_part": "Part {part}/{total}",
+        "preview_content": "Preview of file content:\n\n```\n{content}\n```",
+        "error_general": "An error occurred: {error}. Please try again.",
         "timeout": "Operation timed out. Please try with a smaller file.",
     },
     "fa": {
@@ -53,29 +54,51 @@ MESSAGES = {
                 "• بدون محدودیت در اندازه فایل\n"
                 "• پردازش سریع با استریمینگ\n"
                 "• پیگیری پیشرفت\n",
-        "file_received": "فایل دریافت شد: {}\nاندازه: {:.2f} مگابایت\n\nمی‌خواهید با این فایل چه کاری انجام دهید؟",
+        "file_received": "فایل دریافت شد: {file_name}\nاندازه: {file_size_mb:.2f} مگابایت\n\nمی‌خواهید با این فایل چه کاری انجام دهید؟",
         "processing": "در حال پردازش فایل شما... لطفاً صبر کنید.",
-        "compressing": "در حال فشرده‌سازی فایل شما به {}...\n\nپیشرفت: {}%",
-        "extracting": "در حال استخراج فایل شما...\n\nپیشرفت: {}%",
+        "compressing": "در حال فشرده‌سازی فایل شما به {format}...\n\nپیشرفت: {progress}%",
+        "extracting": "در حال استخراج فایل شما...\n\nپیشرفت: {progress}%",
         "compression_complete": "فشرده‌سازی کامل شد! در حال ارسال فایل فشرده...",
         "extraction_complete": "استخراج کامل شد! در حال ارسال فایل(های) استخراج شده...",
-        "extraction_too_many_files": "استخراج کامل شد! {} فایل وجود دارد. ارسال آنها به صورت یک آرشیو فشرده...",
+        "extraction_too_many_files": "استخراج کامل شد! {count} فایل وجود دارد. ارسال آنها به صورت یک آرشیو فشرده...",
         "task_cancelled": "عملیات با موفقیت لغو شد.",
         "no_active_task": "هیچ عملیات فعالی برای لغو وجود ندارد.",
         "error_unsupported_format": "فرمت فایل پشتیبانی نمی‌شود. فرمت‌های پشتیبانی شده برای استخراج: zip، tar.gz، rar، 7z",
-        "error_processing": "خطا در پردازش فایل شما: {}",
+        "error_processing": "خطا در پردازش فایل شما: {error}",
         "error_file_corrupted": "به نظر می‌رسد فایل خراب یا نامعتبر است.",
         "error_extraction": "استخراج فایل امکان‌پذیر نیست. ممکن است فایل دارای رمز عبور یا خراب باشد.",
-        "error_compression": "فشرده‌سازی فایل امکان‌پذیر نیست: {}",
+        "error_compression": "فشرده‌سازی فایل امکان‌پذیر نیست: {error}",
         "compress_format_select": "فرمت فشرده‌سازی را انتخاب کنید:",
         "file_too_large_telegram": "فایل برای ارسال از طریق تلگرام بسیار بزرگ است. آن را به قسمت‌های کوچکتر تقسیم می‌کنم.",
-        "split_part": "بخش {}/{} از استخراج شما",
-        "preview_content": "پیش‌نمایش محتوای فایل:\n\n```\n{}\n```",
-        "error_general": "خطایی رخ داد: {}. لطفاً دوباره تلاش کنید.",
+        "split_part": "بخش {part}/{total}",
+        "preview_content": "پیش‌نمایش محتوای فایل:\n\n```\n{content}\n```",
+        "error_general": "خطایی رخ داد: {error}. لطفاً دوباره تلاش کنید.",
         "timeout": "زمان عملیات به پایان رسید. لطفاً با فایل کوچکتری امتحان کنید.",
     }
 }
 
+_CONVERSIONS = {None: None, "s": str, "r": repr, "a": ascii}
+
+def _precompile(text):
+    """
+    Split a message template into (literal, field, conversion, format_spec) segments
+    
+    Only named fields are allowed, so values are always looked up by keyword.
+    """
+    segments = []
+    for literal, field_name, format_spec, conversion in Formatter().parse(text):
+        if field_name is not None and (not field_name.isidentifier() or "{" in (format_spec or "")):
+            raise ValueError(f"Message templates must use simple named fields: {text!r}")
+        segments.append((literal, field_name, _CONVERSIONS[conversion], format_spec or ""))
+    return segments
+
+# Templates are parsed once at import so get_message only has to concatenate
+_COMPILED = {
+    (lang, key): _precompile(text)
+    for lang in MESSAGES
+    for key, text in MESSAGES[lang].items()
+}
+
 def get_message(key, lang="en", **kwargs):
     """
     Get a message string in the specified language with optional formatting
@@ -96,10 +119,18 @@ def get_message(key, lang="en", **kwargs):
     message = MESSAGES[lang].get(key, key)
     
     # Apply formatting if kwargs provided
-    if kwargs:
+    if kwargs and key in MESSAGES[lang]:
+        parts = []
         try:
-            return message.format(**kwargs)
+            for literal, field, conversion, format_spec in _COMPILED[(lang, key)]:
+                parts.append(literal)
+                if field is not None:
+                    value = kwargs[field]
+                    if conversion is not None:
+                        value = conversion(value)
+                    parts.append(format(value, format_spec))
         except (KeyError, ValueError):
             return message
+        return "".join(parts)
     
     return message
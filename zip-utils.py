@@ -1,22 +1,99 @@
 # zip_utils.py - Utilities for file compression and extraction
 import os
+import io
+import re
+import errno
 import asyncio
+import time
 import aiofiles
 import zipfile
 import tarfile
 import py7zr
 import rarfile
 import shutil
+import concurrent.futures
+import multiprocessing
+import mimetypes
+import struct
+import functools
 from typing import List, Dict, Tuple, Callable, Optional, BinaryIO
 import logging
 from pathlib import Path
 
-from config import TEMP_DIR, CHUNK_SIZE, COMPRESSION_FORMATS
+# zlib-ng is a faster drop-in for zlib; fall back to the stdlib when it isn't installed
+try:
+    from zlib_ng import zlib_ng as zlib
+except ImportError:
+    import zlib
+
+from fs_utils import silent_remove
+from config import TEMP_DIR, CHUNK_SIZE, READ_BUFFER_SIZE, COMPRESSION_FORMATS, MAX_CONCURRENT_TASKS, FAST_COMPRESSION_SIZE
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# How often (in seconds) worker progress is polled from the event loop
+PROGRESS_POLL_INTERVAL = 0.5
+
+# Native 7-Zip binary (7zz from 7-Zip, or 7z from p7zip); py7zr is used when neither is installed
+SEVEN_ZIP_BIN = shutil.which("7zz") or shutil.which("7z")
+_PERCENT_RE = re.compile(rb"(\d+)%")
+
+# Split files with in-kernel copies; switched off if the filesystem rejects sendfile
+_USE_SENDFILE = hasattr(os, "sendfile")
+
+# Already-compressed formats that are stored in ZIPs without DEFLATE; gzip/bzip2/xz
+# files are caught by the encoding mimetypes reports for them (see compress_file)
+STORED_MIME_PREFIXES = ("image/", "video/", "audio/")
+STORED_MIMES = {
+    "application/zip",
+    "application/x-7z-compressed",
+    "application/vnd.rar",
+    "application/x-rar-compressed",
+    "application/zstd",
+}
+
+# Load the system MIME tables once at import instead of on the first upload
+mimetypes.init()
+
+@functools.lru_cache(maxsize=4096)
+def _guess_mime(suffixes: str) -> Tuple[Optional[str], Optional[str]]:
+    """Guess (MIME type, encoding) from a file's trailing suffixes (e.g. ".tar.gz"), cached per suffix"""
+    return mimetypes.guess_type(f"file{suffixes}", strict=False)
+
+# Shared per-slot counters so pool workers can report progress and see cancellation
+_progress = multiprocessing.Array('q', MAX_CONCURRENT_TASKS, lock=False)
+_cancelled = multiprocessing.Array('b', MAX_CONCURRENT_TASKS, lock=False)
+
+def _init_worker(progress, cancelled):
+    """Attach the shared progress arrays inside a pool worker"""
+    global _progress, _cancelled
+    _progress = progress
+    _cancelled = cancelled
+
+# Process pool for CPU-bound compression, keeping the event loop free. It is created
+# on first use so pool workers (which import this module) don't build pools of their own.
+_POOL: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+def _get_pool() -> concurrent.futures.ProcessPoolExecutor:
+    """Return the compression process pool, creating it on first use"""
+    global _POOL
+    if _POOL is None:
+        # Workers start from a forkserver so they never fork the bot's threads and sockets
+        _POOL = concurrent.futures.ProcessPoolExecutor(
+            max_workers=MAX_CONCURRENT_TASKS,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=_init_worker,
+            initargs=(_progress, _cancelled)
+        )
+    return _POOL
+
+# Progress slots not currently owned by a running worker job
+_free_slots: asyncio.Queue = asyncio.Queue()
+for _slot in range(MAX_CONCURRENT_TASKS):
+    _free_slots.put_nowait(_slot)
+
 class CompressionTask:
     """Class to manage compression tasks with progress tracking"""
     
@@ -33,8 +110,17 @@ class CompressionTask:
         self.output_format = output_format
         self.progress_callback = progress_callback
         self.canceled = False
-        self.total_size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        try:
+            self.total_size = os.stat(file_path).st_size
+        except FileNotFoundError:
+            self.total_size = 0
         self.processed_size = 0
+        self._last_emit = 0.0
+        self._last_progress = -1
+        
+        # Only the freshest progress value waits here; one consumer delivers them in order
+        self._progress_queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._consumer: Optional[asyncio.Task] = None
         
     def update_progress(self, chunk_size: int):
         """Update progress based on processed chunk size"""
@@ -44,12 +130,363 @@ class CompressionTask:
         self.processed_size += chunk_size
         if self.total_size > 0 and self.progress_callback:
             progress = min(int((self.processed_size / self.total_size) * 100), 100)
-            asyncio.create_task(self.progress_callback(progress))
+            
+            # Emit at most once per second (always emit completion) to respect Telegram rate limits
+            now = time.monotonic()
+            if progress != self._last_progress and (progress == 100 or now - self._last_emit >= 1.0):
+                self._last_emit = now
+                self._last_progress = progress
+                
+                # Replace any value the consumer hasn't picked up yet
+                try:
+                    self._progress_queue.put_nowait(progress)
+                except asyncio.QueueFull:
+                    self._progress_queue.get_nowait()
+                    self._progress_queue.put_nowait(progress)
+                
+                if self._consumer is None or self._consumer.done():
+                    self._consumer = asyncio.create_task(self._consume_progress())
+    
+    async def _consume_progress(self):
+        """Deliver queued progress values one at a time, exiting once the queue is drained"""
+        while not self._progress_queue.empty():
+            await self.progress_callback(self._progress_queue.get_nowait())
+    
+    async def flush_progress(self):
+        """Wait until every queued progress update has been delivered"""
+        if self._consumer is not None:
+            await self._consumer
+    
+    def discard_progress(self):
+        """Drop pending progress updates and stop the consumer"""
+        while not self._progress_queue.empty():
+            self._progress_queue.get_nowait()
+        if self._consumer is not None:
+            self._consumer.cancel()
             
     def cancel(self):
         """Cancel the task"""
         self.canceled = True
 
+def shutdown_pool():
+    """Stop the compression process pool, dropping jobs that haven't started"""
+    if _POOL is not None:
+        _POOL.shutdown(wait=False, cancel_futures=True)
+
+def _report_progress(slot: int, nbytes: int):
+    """Report processed bytes from a pool worker, aborting if cancelled"""
+    if _cancelled[slot]:
+        raise asyncio.CancelledError("Task was cancelled")
+    _progress[slot] += nbytes
+
+# ZIP record layouts (see PKWARE APPNOTE.TXT); every ZIP written here is a single entry
+_ZIP_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_ZIP_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_ZIP64_END_RECORD = struct.Struct("<IQHHIIQQQQ")
+_ZIP64_END_LOCATOR = struct.Struct("<IIQI")
+_ZIP_END_RECORD = struct.Struct("<IHHHHIIH")
+_ZIP64_LIMIT = 0xFFFFFFFF
+_ZIP64_VERSION = 45
+
+def _dos_datetime(timestamp: float) -> Tuple[int, int]:
+    """Convert a Unix timestamp into ZIP (MS-DOS) date and time fields"""
+    t = time.localtime(timestamp)
+    if t.tm_year < 1980:
+        return (1 << 5) | 1, 0
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return dos_date, dos_time
+
+def _zip_sync(src: str, dst: str, arcname: str, method: int, level: int, slot: int):
+    """
+    Write a single-entry ZIP in one shot (runs in the process pool)
+    
+    Streams raw DEFLATE (or stored) data with a running CRC instead of going
+    through zipfile, then patches the sizes into the Zip64 local header and
+    appends the central directory.
+    """
+    try:
+        name = arcname.encode("ascii")
+        flags = 0
+    except UnicodeEncodeError:
+        name = arcname.encode("utf-8")
+        flags = 0x800
+    
+    with open(src, 'rb', buffering=READ_BUFFER_SIZE) as f, open(dst, 'wb', buffering=READ_BUFFER_SIZE) as out:
+        st = os.fstat(f.fileno())
+        dos_date, dos_time = _dos_datetime(st.st_mtime)
+        
+        # Local header with placeholder CRC/sizes; real sizes go in the Zip64 extra field
+        out.write(_ZIP_LOCAL_HEADER.pack(
+            0x04034b50, _ZIP64_VERSION, flags, method, dos_time, dos_date,
+            0, _ZIP64_LIMIT, _ZIP64_LIMIT, len(name), 20
+        ))
+        out.write(name)
+        sizes_offset = out.tell() + 4
+        out.write(struct.pack("<HHQQ", 0x0001, 16, 0, 0))
+        data_offset = out.tell()
+        
+        # Reuse one buffer for every chunk instead of allocating new bytes
+        buf = bytearray(READ_BUFFER_SIZE)
+        view = memoryview(buf)
+        crc = 0
+        file_size = 0
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15) if method == zipfile.ZIP_DEFLATED else None
+        while (n := f.readinto(buf)):
+            chunk = view[:n]
+            crc = zlib.crc32(chunk, crc)
+            out.write(compressor.compress(chunk) if compressor else chunk)
+            file_size += n
+            _report_progress(slot, n)
+        if compressor:
+            out.write(compressor.flush())
+        
+        cd_offset = out.tell()
+        compress_size = cd_offset - data_offset
+        
+        # Patch the CRC and the Zip64 sizes now that they are known
+        out.seek(14)
+        out.write(struct.pack("<I", crc))
+        out.seek(sizes_offset)
+        out.write(struct.pack("<QQ", file_size, compress_size))
+        out.seek(cd_offset)
+        
+        # Central directory entry; Zip64 sizes only when they don't fit in 32 bits
+        extra = b""
+        cd_file_size, cd_compress_size = file_size, compress_size
+        if file_size >= _ZIP64_LIMIT or compress_size >= _ZIP64_LIMIT:
+            extra = struct.pack("<HHQQ", 0x0001, 16, file_size, compress_size)
+            cd_file_size = cd_compress_size = _ZIP64_LIMIT
+        out.write(_ZIP_CENTRAL_HEADER.pack(
+            0x02014b50, (3 << 8) | _ZIP64_VERSION, _ZIP64_VERSION, flags, method, dos_time, dos_date,
+            crc, cd_compress_size, cd_file_size, len(name), len(extra), 0, 0, 0,
+            (st.st_mode & 0xFFFF) << 16, 0
+        ))
+        out.write(name)
+        out.write(extra)
+        cd_size = out.tell() - cd_offset
+        
+        # End of central directory, with Zip64 records when the offset overflows
+        if cd_offset >= _ZIP64_LIMIT:
+            zip64_end_offset = out.tell()
+            out.write(_ZIP64_END_RECORD.pack(
+                0x06064b50, 44, _ZIP64_VERSION, _ZIP64_VERSION, 0, 0, 1, 1, cd_size, cd_offset
+            ))
+            out.write(_ZIP64_END_LOCATOR.pack(0x07064b50, 0, zip64_end_offset, 1))
+        out.write(_ZIP_END_RECORD.pack(
+            0x06054b50, 0, 0, 1, 1, cd_size, min(cd_offset, _ZIP64_LIMIT), 0
+        ))
+
+class _ProgressReader(io.BufferedIOBase):
+    """Read-only file wrapper that reports bytes read to a progress slot (and aborts when cancelled)"""
+    
+    def __init__(self, raw: BinaryIO, slot: int):
+        self._raw = raw
+        self._slot = slot
+    
+    def readable(self) -> bool:
+        return True
+    
+    def seekable(self) -> bool:
+        return True
+    
+    def read(self, size: int = -1) -> bytes:
+        data = self._raw.read(size)
+        _report_progress(self._slot, len(data))
+        return data
+    
+    read1 = read
+    
+    def readinto(self, b) -> int:
+        n = self._raw.readinto(b)
+        _report_progress(self._slot, n)
+        return n
+    
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self._raw.seek(offset, whence)
+    
+    def tell(self) -> int:
+        return self._raw.tell()
+
+def _targz_sync(src: str, dst: str, arcname: str, slot: int):
+    """Compress a file to TAR.GZ in one shot (runs in the process pool)"""
+    with tarfile.open(dst, "w:gz", copybufsize=READ_BUFFER_SIZE) as tar, \
+            open(src, 'rb', buffering=READ_BUFFER_SIZE) as f:
+        tarinfo = tar.gettarinfo(arcname=arcname, fileobj=f)
+        tar.addfile(tarinfo, _ProgressReader(f, slot))
+
+def _7z_sync(src: str, dst: str, arcname: str, slot: int):
+    """Compress a file to 7Z in one shot (runs in the process pool)"""
+    with py7zr.SevenZipFile(dst, 'w') as archive, open(src, 'rb', buffering=READ_BUFFER_SIZE) as f:
+        archive.writef(_ProgressReader(f, slot), arcname)
+
+def _pool_job(func: Callable, src: str, dst: str, *args):
+    """Run an archive helper in a pool worker, removing its partial output if it fails"""
+    try:
+        return func(src, dst, *args)
+    except BaseException:
+        # A job picked up after its task was cancelled still creates dst before aborting
+        silent_remove(dst)
+        raise
+
+def _release_slot(slot: int, future: asyncio.Future):
+    """Hand a progress slot back once its worker has really stopped using it"""
+    if not future.cancelled():
+        # Retrieve the result so abandoned (cancelled) jobs don't log warnings
+        future.exception()
+    _free_slots.put_nowait(slot)
+
+async def _run_in_pool(task: CompressionTask, func: Callable, *args):
+    """
+    Run an archive helper in the process pool while polling its progress
+    
+    Args:
+        task: Compression task receiving progress updates
+        func: Synchronous helper to run; receives a progress slot as last argument
+        *args: Positional arguments for the helper, starting with (src, dst)
+        
+    Returns:
+        The helper's return value
+    """
+    loop = asyncio.get_running_loop()
+    slot = await _free_slots.get()
+    _progress[slot] = 0
+    _cancelled[slot] = 0
+    
+    future = loop.run_in_executor(_get_pool(), _pool_job, func, *args, slot)
+    future.add_done_callback(lambda f: _release_slot(slot, f))
+    
+    try:
+        reported = 0
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=PROGRESS_POLL_INTERVAL)
+            processed = _progress[slot]
+            if processed > reported:
+                task.update_progress(processed - reported)
+                reported = processed
+            if done:
+                break
+        
+        result = future.result()
+        
+        # Top off progress for helpers that can't report incrementally
+        if task.processed_size < task.total_size:
+            task.update_progress(task.total_size - task.processed_size)
+        return result
+    except BaseException:
+        # Ask the worker to stop at its next progress report
+        _cancelled[slot] = 1
+        raise
+
+def _copy_range(src: BinaryIO, dst: BinaryIO, offset: int, count: int):
+    """Copy count bytes starting at offset from src to dst, in-kernel when possible"""
+    global _USE_SENDFILE
+    if _USE_SENDFILE:
+        try:
+            while count:
+                sent = os.sendfile(dst.fileno(), src.fileno(), offset, count)
+                if sent == 0:
+                    raise IOError(f"Unexpected end of file while copying {src.name}")
+                offset += sent
+                count -= sent
+            return
+        except OSError as e:
+            # Filesystem doesn't support sendfile; finish (and continue) with buffered copies
+            if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSUP, errno.EXDEV):
+                raise
+            _USE_SENDFILE = False
+    
+    src.seek(offset)
+    buf = bytearray(min(READ_BUFFER_SIZE, count))
+    view = memoryview(buf)
+    while count:
+        n = src.readinto(view[:min(len(buf), count)])
+        if not n:
+            raise IOError(f"Unexpected end of file while copying {src.name}")
+        dst.write(view[:n])
+        count -= n
+
+def split_file(src: str, parts_dir: str, part_size: int) -> List[str]:
+    """
+    Split a file into numbered parts, copying in-kernel with os.sendfile
+    
+    Args:
+        src: Path to the file to split
+        parts_dir: Directory to write the parts to
+        part_size: Maximum size of each part in bytes
+        
+    Returns:
+        List[str]: Paths to the parts, in order
+    """
+    base = os.path.basename(src)
+    parts = []
+    try:
+        with open(src, 'rb', buffering=0) as f:
+            total = os.fstat(f.fileno()).st_size
+            for offset in range(0, total, part_size):
+                part_path = os.path.join(parts_dir, f"{base}.{len(parts) + 1:03d}")
+                parts.append(part_path)
+                with open(part_path, 'wb', buffering=0) as out:
+                    _copy_range(f, out, offset, min(part_size, total - offset))
+    except BaseException:
+        # The caller never sees the parts on failure, so clean them up here
+        for part_path in parts:
+            silent_remove(part_path)
+        raise
+    return parts
+
+async def _7z_native(task: CompressionTask, src: str, dst: str):
+    """
+    Compress a file to 7Z with the native 7-Zip CLI, parsing its progress output
+    
+    Args:
+        task: Compression task receiving progress updates
+        src: Path to the file to compress
+        dst: Path of the archive to create
+    """
+    # 7z "a" adds to an existing archive, so always start from scratch
+    silent_remove(dst)
+    
+    # -spd disables wildcard matching and "--" ends switch parsing, so user-supplied
+    # file names are always taken literally; stderr is merged so neither pipe can fill up
+    process = await asyncio.create_subprocess_exec(
+        SEVEN_ZIP_BIN, "a", "-bsp1", "-bso0", "-mmt=on", "-y", "-spd", "--", dst, src,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT
+    )
+    
+    try:
+        reported = 0
+        tail = b""
+        while True:
+            data = await process.stdout.read(4096)
+            if not data:
+                break
+            
+            # Keep the end of the output for the error message
+            tail = (tail + data)[-4096:]
+            
+            # Progress is redrawn in place with backspaces, so scan for every "NN%"
+            for match in _PERCENT_RE.finditer(data):
+                processed = task.total_size * int(match.group(1)) // 100
+                if processed > reported:
+                    task.update_progress(processed - reported)
+                    reported = processed
+        
+        returncode = await process.wait()
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    
+    if returncode != 0:
+        output = tail.decode(errors="replace").replace("\b", "").strip()
+        raise RuntimeError(f"7z failed with exit code {returncode}: {output}")
+    
+    if task.processed_size < task.total_size:
+        task.update_progress(task.total_size - task.processed_size)
+
 async def compress_file(
     file_path: str, 
     output_format: str = "zip", 
@@ -68,63 +505,48 @@ async def compress_file(
     """
     task = CompressionTask(file_path, output_format, progress_callback)
     file_name = os.path.basename(file_path)
-    output_path = os.path.join(TEMP_DIR, f"{os.path.splitext(file_name)[0]}{COMPRESSION_FORMATS[output_format]}")
+    stem, _ = os.path.splitext(file_name)
+    output_path = os.path.join(TEMP_DIR, f"{stem}{COMPRESSION_FORMATS[output_format]}")
     
+    try:
+        await _compress_file(task, file_path, file_name, output_format, output_path)
+    except BaseException:
+        # Don't let progress edits land after the error/cancel message
+        task.discard_progress()
+        # The caller only tracks the archive on success, so drop the partial one here
+        silent_remove(output_path)
+        raise
+    
+    # Deliver the final progress edits before the caller reports completion
+    await task.flush_progress()
+    return output_path
+
+async def _compress_file(task: CompressionTask, file_path: str, file_name: str, output_format: str, output_path: str) -> str:
+    """Write the archive at output_path for compress_file, reporting progress through task"""
     try:
         if output_format == "zip":
-            # Use zipfile for ZIP compression
-            with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                # Get file size for progress tracking
-                file_size = os.path.getsize(file_path)
+            # Store already-compressed media as-is and favour speed for very large files
+            mime, encoding = _guess_mime("".join(Path(file_name).suffixes[-2:]).lower())
+            if encoding or (mime and (mime.startswith(STORED_MIME_PREFIXES) or mime in STORED_MIMES)):
+                method = zipfile.ZIP_STORED
+            else:
+                method = zipfile.ZIP_DEFLATED
+            level = 1 if task.total_size > FAST_COMPRESSION_SIZE else 6
+            
+            # Stream raw DEFLATE/stored data into a single-entry ZIP
+            await _run_in_pool(task, _zip_sync, file_path, output_path, file_name, method, level)
                 
-                # Open file in binary mode for reading chunks
-                async with aiofiles.open(file_path, 'rb') as f:
-                    # Process file in chunks to handle large files
-                    chunk_size = CHUNK_SIZE
-                    bytes_read = 0
-                    
-                    # Create a temporary file for the chunk
-                    temp_chunk_path = os.path.join(TEMP_DIR, f"chunk_{file_name}")
-                    
-                    while True:
-                        chunk = await f.read(chunk_size)
-                        if not chunk:
-                            break
-                            
-                        # Write chunk to temporary file
-                        async with aiofiles.open(temp_chunk_path, 'wb') as temp_f:
-                            await temp_f.write(chunk)
-                        
-                        # Add the chunk to zip
-                        zipf.write(temp_chunk_path, file_name)
-                        
-                        # Update progress
-                        bytes_read += len(chunk)
-                        task.update_progress(len(chunk))
-                        
-                        # Allow other tasks to run
-                        await asyncio.sleep(0)
-                    
-                    # Remove temporary chunk file
-                    if os.path.exists(temp_chunk_path):
-                        os.remove(temp_chunk_path)
-                        
         elif output_format == "tar.gz":
             # Use tarfile for TAR.GZ compression
-            with tarfile.open(output_path, "w:gz") as tar:
-                # Add file to tar archive
-                tar.add(file_path, arcname=os.path.basename(file_path))
-                
-                # Update progress (approximate as tarfile doesn't provide progress)
-                task.update_progress(task.total_size)
+            await _run_in_pool(task, _targz_sync, file_path, output_path, file_name)
                 
         elif output_format == "7z":
-            # Use py7zr for 7Z compression
-            with py7zr.SevenZipFile(output_path, 'w') as archive:
-                archive.write(file_path, os.path.basename(file_path))
-                
-                # Update progress (approximate as py7zr doesn't provide progress)
-                task.update_progress(task.total_size)
+            if SEVEN_ZIP_BIN:
+                # Use the native 7-Zip CLI (multi-threaded LZMA2) for 7Z compression
+                await _7z_native(task, file_path, output_path)
+            else:
+                # Fall back to py7zr for 7Z compression
+                await _run_in_pool(task, _7z_sync, file_path, output_path, file_name)
                 
         elif output_format == "rar":
             # Use unrar for RAR compression via subprocess